@@ -66,7 +66,7 @@ def train_model(model, train_loader, val_loader, criterion, optimizer, scheduler
         for frames, labels in tqdm(train_loader, desc=f"Training {ablation_mode}"):
             frames, labels = frames.to(device), labels.to(device)
             
-            optimizer.zero_grad()
+            optimizer.zero_grad(set_to_none=True)
             outputs = model(frames, batch_size=video_batch_size, ablation=ablation_mode)
             logits = outputs['logits']
             
@@ -352,7 +352,7 @@ def ablation_experiment():
         criterion = nn.BCEWithLogitsLoss()
         
         # 定义优化器
-        optimizer = optim.Adam(model.parameters(), lr=args.lr, weight_decay=1e-4)
+        optimizer = optim.Adam([p for p in model.parameters() if p.requires_grad], lr=args.lr, weight_decay=1e-4)
         
         # 学习率调度器
         scheduler = optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=args.epochs, eta_min=1e-7)
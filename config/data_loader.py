@@ -5,7 +5,49 @@ import random
 import json
 import numpy as np
 import torch
-from torch.utils.data import Dataset
+import torch.distributed as dist
+from concurrent.futures import ThreadPoolExecutor
+from torch.utils.data import Dataset, Sampler
+
+# 禁用OpenCV内部线程池，避免与DataLoader worker及帧读取线程叠加导致CPU过载
+cv2.setNumThreads(0)
+
+# 各进程的帧读取线程池缓存，按进程号区分，DataLoader子进程各自创建一次并复用
+_frame_pools = {}
+
+def _get_frame_pool(num_threads):
+    """
+    获取当前进程的帧读取线程池，首次调用时创建
+    
+    :param num_threads: 线程数
+    :type num_threads: int
+    :return: 返回线程池
+    :rtype: concurrent.futures.ThreadPoolExecutor
+    """
+    key = (os.getpid(), num_threads)
+    if key not in _frame_pools:
+        _frame_pools[key] = ThreadPoolExecutor(max_workers=num_threads)
+    return _frame_pools[key]
+
+def _load_frame(file_path, transform=None):
+    """
+    读取单帧图像并应用数据预处理
+    
+    :param file_path: 帧图像路径
+    :type file_path: str
+    :param transform: 数据预处理
+    :type transform: callable
+    :return: 返回处理后的帧，读取失败时为空白帧
+    """
+    img = cv2.imread(file_path)
+    if img is not None:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    else: # 忽略无效帧
+        img = np.zeros((224, 224, 3), dtype=np.uint8)
+    
+    if transform:
+        img = transform(img)
+    return img
 
 class FaceForensicsLoader(Dataset):
     """
@@ -20,7 +62,9 @@ class FaceForensicsLoader(Dataset):
                  methods=['Deepfakes', 'Face2Face', 'FaceSwap', 'NeuralTextures', 'FaceShifter'],
                  fixed_sample_ratio=1.0,
                  novelty_ratio=0.0,
-                 single_method=None
+                 single_method=None,
+                 all_methods=False,
+                 num_threads=4
                  ):
         """
         初始化FaceForensicsLoader
@@ -37,6 +81,13 @@ class FaceForensicsLoader(Dataset):
         :type compression: str
         :param methods: 伪造方法列表
         :type methods: list
+        :param single_method: 测试集仅加载指定方法的伪造视频
+        :type single_method: str
+        :param all_methods: 测试集加载所有方法的伪造视频，用于一次遍历后按方法统计指标，
+            参见``get_sample_methods``
+        :type all_methods: bool
+        :param num_threads: 单个样本内并行读取帧的线程数
+        :type num_threads: int
         """
         super().__init__()
         self.root = root
@@ -48,6 +99,8 @@ class FaceForensicsLoader(Dataset):
         self.fixed_sample_ratio = fixed_sample_ratio
         self.novelty_ratio = novelty_ratio
         self.single_method = single_method
+        self.all_methods = all_methods
+        self.num_threads = num_threads
         self.current_epoch = 0
         
         # 加载数据集划分文件
@@ -154,6 +207,14 @@ class FaceForensicsLoader(Dataset):
                 fake_dirs.append(selected)
                 method_counts[selected['method']] += 1
             
+            if self.split == 'test' and self.all_methods:
+                # 测试集：收集所有方法的伪造视频，并标记均匀提取的样本（即整体评估所用样本）
+                balanced_paths = {video['path'] for video in fake_dirs}
+                fake_dirs = []
+                for video_id, methods_available in method_videos.items():
+                    for video in methods_available:
+                        fake_dirs.append({**video, 'balanced': video['path'] in balanced_paths})
+            
         
         # 打乱伪造视频的顺序，确保不同方法的视频混合在一起
         random.shuffle(fake_dirs)
@@ -168,6 +229,22 @@ class FaceForensicsLoader(Dataset):
         
         return real_dirs, fake_dirs
     
+    def get_sample_methods(self):
+        """
+        获取测试集每个样本对应的伪造方法
+        
+        :return: 返回与样本索引对齐的数组``(methods, balanced)``
+        :rtype: tuple
+        
+        ``methods``
+            每个样本的伪造方法，真实视频为``'Original'``
+        ``balanced``
+            样本是否属于整体评估集合（真实视频与均匀提取的伪造视频）
+        """
+        methods = ['Original'] * len(self.real_videos) + [video['method'] for video in self.fake_videos]
+        balanced = [True] * len(self.real_videos) + [video.get('balanced', True) for video in self.fake_videos]
+        return np.array(methods), np.array(balanced, dtype=bool)
+    
     def _init_sampling_strategy(self):
         """初始化样本采样策略，为训练和验证创建不同的样本集"""
         # 初始化视频使用计数
@@ -225,6 +302,10 @@ class FaceForensicsLoader(Dataset):
         self.current_fake = list({v['path']: v for v in self.current_fake}.values())
         
         random.shuffle(self.current_fake)
+        
+        # 更新视频使用计数（在主进程中统计，DataLoader子进程中的修改不会回传）
+        for video in self.current_fake:
+            self.video_usage_counts[video['path']] += 1
     
     def update_sampling_strategy(self, epoch, max_epochs):
         """
@@ -292,9 +373,6 @@ class FaceForensicsLoader(Dataset):
                 if fake_index >= len(self.current_fake):
                     raise IndexError(f"Index '{index}' out of range")
                 frames_dir = self.current_fake[fake_index]['path']
-                
-                # 更新视频使用计数
-                self.video_usage_counts[frames_dir] = self.video_usage_counts.get(frames_dir, 0) + 1
             else:
                 if fake_index >= len(self.fake_videos):
                     raise IndexError(f"Index '{index}' out of range")
@@ -319,19 +397,9 @@ class FaceForensicsLoader(Dataset):
             while len(selected_files) < self.frame_count:
                 selected_files.append(frame_files[-1])
             
-        # 读取帧
-        frames = []
-        for file_path in selected_files:
-            img = cv2.imread(file_path)
-            if img is not None: # 忽略无效帧
-                img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-                frames.append(img)
-            else:
-                blank = np.zeros((224, 224, 3), dtype=np.uint8)
-                frames.append(blank)
-        
-        if self.transform:
-            frames = [self.transform(frame) for frame in frames]
+        # 多线程读取帧（cv2解码与PIL变换会释放GIL）
+        pool = _get_frame_pool(self.num_threads)
+        frames = list(pool.map(lambda path: _load_frame(path, self.transform), selected_files))
             
         # 转换为张量 (T x C x H x W)
         frames = torch.stack([frame for frame in frames if isinstance(frame, torch.Tensor)])
@@ -348,7 +416,8 @@ class CelebDFLoader(Dataset):
                  split=['train', 'test'],
                  frame_count=24,
                  transform=None,
-                 testing_file=None):
+                 testing_file=None,
+                 num_threads=4):
         """
         初始化CelebDFLoader
         :param root: CelebDF数据集的根目录
@@ -361,6 +430,8 @@ class CelebDFLoader(Dataset):
         :type transform: callable
         :param testing_file: 测试集划分文件路径
         :type testing_file: str
+        :param num_threads: 单个样本内并行读取帧的线程数
+        :type num_threads: int
         """
         super().__init__()
         self.root = root
@@ -368,6 +439,7 @@ class CelebDFLoader(Dataset):
         self.frame_count = frame_count
         self.transform = transform
         self.testing_file = testing_file
+        self.num_threads = num_threads
         
         self.real_videos, self.synthetic_videos = self._load_frames_dirs()
         
@@ -518,21 +590,114 @@ class CelebDFLoader(Dataset):
             while len(selected_files) < self.frame_count:
                 selected_files.append(frame_files[-1])
                 
-        # 读取帧
-        frames = []
-        for file_path in selected_files:
-            img = cv2.imread(file_path)
-            if img is not None:
-                img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-                frames.append(img)
-            else:
-                blank = np.zeros((224, 224, 3), dtype=np.uint8)
-                frames.append(blank)
-                
-        if self.transform:
-            frames = [self.transform(frame) for frame in frames]
+        # 多线程读取帧（cv2解码与PIL变换会释放GIL）
+        pool = _get_frame_pool(self.num_threads)
+        frames = list(pool.map(lambda path: _load_frame(path, self.transform), selected_files))
             
         # 转换为张量 (T x C x H x W)
         frames = torch.stack([frame for frame in frames if isinstance(frame, torch.Tensor)])
         
-        return frames, label
\ No newline at end of file
+        return frames, label
+
+class CUDAPrefetcher:
+    """
+    CUDAPrefetcher - 在独立CUDA流上预取下一批数据
+    
+    当前批次在默认流上计算时，下一批次的H2D拷贝在副流上进行，使数据传输与模型计算重叠。
+    需要数据加载器设置``pin_memory=True``，否则``non_blocking``拷贝不会异步执行。
+    """
+    def __init__(self, dataloader, device):
+        """
+        初始化CUDAPrefetcher
+        
+        :param dataloader: 数据加载器
+        :type dataloader: torch.utils.data.DataLoader
+        :param device: 目标设备
+        :type device: torch.device or str
+        """
+        self.dataloader = dataloader
+        self.device = torch.device(device)
+        self.stream = torch.cuda.Stream(device=self.device) if self.device.type == 'cuda' else None
+        
+        self.loader_iter = iter(dataloader)
+        self.preload()
+        
+    def __len__(self):
+        return len(self.dataloader)
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self):
+        batch = self.next()
+        if batch is None:
+            raise StopIteration
+        return batch
+        
+    def preload(self):
+        """从数据加载器取出下一批次，并在副流上发起拷贝"""
+        try:
+            frames, labels = next(self.loader_iter)
+        except StopIteration:
+            self.next_frames = None
+            self.next_labels = None
+            return
+        
+        if self.stream is None:
+            self.next_frames = frames.to(self.device)
+            self.next_labels = labels.to(self.device)
+            return
+        
+        with torch.cuda.stream(self.stream):
+            self.next_frames = frames.to(self.device, non_blocking=True)
+            self.next_labels = labels.to(self.device, non_blocking=True)
+            
+    def next(self):
+        """
+        返回已预取的批次，并预取下一批次
+        
+        :return: 返回``(frames, labels)``，数据取尽时返回None
+        :rtype: tuple or None
+        """
+        if self.stream is not None:
+            torch.cuda.current_stream(self.device).wait_stream(self.stream)
+        
+        frames, labels = self.next_frames, self.next_labels
+        if frames is None:
+            return None
+        
+        if self.stream is not None:
+            # 张量在副流上分配，需登记到当前流上使用，防止被缓存分配器提前回收
+            frames.record_stream(torch.cuda.current_stream(self.device))
+            labels.record_stream(torch.cuda.current_stream(self.device))
+        
+        self.preload()
+        return frames, labels
+
+class DistributedEvalSampler(Sampler):
+    """
+    DistributedEvalSampler - 分布式验证采样器
+    
+    各进程按rank交错读取互不重叠的样本，与DistributedSampler不同，不会为对齐各进程样本数而填充重复样本，
+    汇总后的预测与损失与单卡验证完全一致。各进程样本数可能相差1，仅适用于前向过程不含集合通信的验证阶段。
+    """
+    def __init__(self, dataset, num_replicas=None, rank=None):
+        """
+        初始化DistributedEvalSampler
+        
+        :param dataset: 数据集
+        :type dataset: torch.utils.data.Dataset
+        :param num_replicas: 进程总数，默认取进程组大小
+        :type num_replicas: int, optional
+        :param rank: 当前进程的rank，默认取进程组中的rank
+        :type rank: int, optional
+        """
+        self.dataset = dataset
+        self.num_replicas = num_replicas if num_replicas is not None else dist.get_world_size()
+        self.rank = rank if rank is not None else dist.get_rank()
+        
+    def __iter__(self):
+        return iter(range(self.rank, len(self.dataset), self.num_replicas))
+    
+    def __len__(self):
+        return len(range(self.rank, len(self.dataset), self.num_replicas))
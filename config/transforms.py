@@ -11,18 +11,36 @@ seed = 42
 random.seed(seed)
 torch.manual_seed(seed)
 
+# ImageNet归一化参数
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+
+# 各设备上的归一化参数缓存，避免每批次重复创建并拷贝
+_norm_stats = {}
+
 class FaceAlignTransform:
     """
     人脸对齐转换器
     """
-    def __init__(self, margin):
+    def __init__(self, margin, device=None):
+        """
+        初始化人脸对齐转换器
+        
+        :param margin: 人脸裁剪边距
+        :type margin: int
+        :param device: MTCNN运行的设备，默认使用cuda:0（无GPU时为cpu）；
+            分布式训练时应传入当前进程的设备，避免所有进程都在GPU 0上检测人脸
+        :type device: torch.device or str, optional
+        """
+        if device is None:
+            device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
         self.margin = margin
         self.mtcnn = MTCNN(
             margin=margin,  # 确保整个面部上下文被捕获
             keep_all=False,
             min_face_size=40,
             post_process=False,
-            device=torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
+            device=torch.device(device)
         )
         
     def __call__(self, image):
@@ -80,40 +98,67 @@ class FaceAlignTransform:
         
         return image.crop((left, top, right, bottom))
 
-def get_transforms():
+def normalize_frames(frames):
+    """
+    在帧所在设备上完成归一化，配合``get_transforms(normalize=False)``使用
+    
+    :param frames: uint8帧张量，形状为 [..., C, H, W]
+    :type frames: torch.Tensor
+    :return: 返回归一化后的float32帧张量
+    :rtype: torch.Tensor
+    """
+    if frames.device not in _norm_stats:
+        _norm_stats[frames.device] = (
+            torch.tensor(IMAGENET_MEAN, device=frames.device).view(3, 1, 1),
+            torch.tensor(IMAGENET_STD, device=frames.device).view(3, 1, 1)
+        )
+    mean, std = _norm_stats[frames.device]
+    return frames.float().div_(255).sub_(mean).div_(std)
+
+def get_transforms(normalize=True, device=None):
     """
     获取数据转换器
     
+    :param normalize: 是否在转换中完成归一化，为False时输出uint8张量，
+        以减少worker到主进程的传输量，归一化需在GPU上调用``normalize_frames``完成
+    :type normalize: bool
+    :param device: 人脸检测（MTCNN）运行的设备，None表示使用默认设备
+    :type device: torch.device or str, optional
     :return: 返回训练、验证和测试数据加载器
     :rtype: dict
     """
+    if normalize:
+        to_tensor = [
+            transforms.ToTensor(),
+            transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD)
+        ]
+    else:
+        to_tensor = [transforms.PILToTensor()]
+    
     # 定义转换
     train_transform = transforms.Compose([
         transforms.ToPILImage(),
-        FaceAlignTransform(margin=20),
+        FaceAlignTransform(margin=20, device=device),
         transforms.Resize(450),
         transforms.CenterCrop(224),
         transforms.ColorJitter(brightness=0.01, contrast=0.01),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+        *to_tensor
     ])
     
     val_transform = transforms.Compose([
         transforms.ToPILImage(),
-        FaceAlignTransform(margin=20),
+        FaceAlignTransform(margin=20, device=device),
         transforms.Resize(450),
         transforms.CenterCrop(224),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+        *to_tensor
     ])
     
     test_transform = transforms.Compose([
         transforms.ToPILImage(),
-        FaceAlignTransform(margin=20),
+        FaceAlignTransform(margin=20, device=device),
         transforms.Resize(450),
         transforms.CenterCrop(224),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+        *to_tensor
     ])
     
     return {
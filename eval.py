@@ -5,23 +5,19 @@ import json
 import numpy as np
 import pandas as pd # type: ignore
 import torch
-from torch.nn import BCEWithLogitsLoss
+from torch import nn
+from torch.nn import functional as F
 from torch.utils.data import DataLoader
 from sklearn.metrics import (  # type: ignore
     roc_auc_score,
-    accuracy_score,
-    precision_score,
-    recall_score,
-    f1_score,
-    confusion_matrix,
     average_precision_score
 )
 from tqdm import tqdm
 
-from config.data_loader import FaceForensicsLoader, CelebDFLoader
-from config.transforms import get_transforms
+from config.data_loader import FaceForensicsLoader, CelebDFLoader, CUDAPrefetcher
+from config.transforms import get_transforms, normalize_frames
 from config.focal_loss import BinaryFocalLoss
-from train import combined_loss
+from train import orthogonal_loss, configure_backends, PRECISION_DTYPES
 from network.model import DeepfakeDetector
 from utils.visualization import EvalVisualization
 
@@ -36,8 +32,8 @@ def parse_args():
                         help="Output directory for results")
     parser.add_argument("--batch-size", "--bs", type=int, default=8,
                         help="Batch size for evaluation")
-    # parser.add_argument("--dim", "--d", type=int, default=128,
-    #                     help="Feature dimension")
+    parser.add_argument("--dim", "--d", type=int, default=128,
+                        help="Feature dimension")
     parser.add_argument("--frame-count", "--fc", type=int, default=300,
                         help="Number of frames per video")
     parser.add_argument("--dataset", "--ds", type=str, default="ff++",
@@ -52,11 +48,18 @@ def parse_args():
                         help="Ablation study type")
     parser.add_argument("--visualize", "--v", action="store_true",
                         help="Generate evaluation visualizations")
+    parser.add_argument("--precision", "--p", type=str, default="fp32",
+                        choices=list(PRECISION_DTYPES.keys()),
+                        help="Autocast precision for evaluation")
+    parser.add_argument("--compile", action="store_true",
+                        help="Compile the model with torch.compile before evaluation")
+    parser.add_argument("--compute-loss", "--cl", action="store_true",
+                        help="Also compute test loss and orthogonal loss (always on with --visualize)")
     parser.add_argument("--seed", type=int, default=42,
                         help="Random seed")
     return parser.parse_args()
 
-def load_model(model_path, dim=128, device="cuda"):
+def load_model(model_path, dim=128, device="cuda", compile_model=False):
     """加载预训练模型"""
     print(f"Loading model from {model_path}...")
     model = DeepfakeDetector(in_channels=3, dama_dim=dim).to(device)
@@ -73,13 +76,22 @@ def load_model(model_path, dim=128, device="cuda"):
             raise ValueError(f"Could not load model from {model_path}")
         
     model.eval()
+    
+    # 推理时Dropout为恒等映射，直接移除
+    model.classifier[2] = nn.Identity()
+    
+    # GPU评估时捕获前向图，消除逐算子的Python调度开销
+    if compile_model and torch.cuda.is_available():
+        model = torch.compile(model, mode='reduce-overhead', fullgraph=False)
+    
     return model
 
 
 def get_dataloader(args):
     """获取数据加载器"""
     print(f"Loading {args.dataset} dataset...")
-    transforms = get_transforms()
+    # 以uint8传输帧，在GPU上完成归一化
+    transforms = get_transforms(normalize=False)
     
     if args.dataset == "ff++":
         dataset = FaceForensicsLoader(
@@ -87,7 +99,8 @@ def get_dataloader(args):
             split="test",
             frame_count=args.frame_count,
             transform=transforms['test'],
-            single_method=getattr(args, 'single_method', None)
+            single_method=getattr(args, 'single_method', None),
+            all_methods=getattr(args, 'all_methods', False)
         )
     elif args.dataset == "celeb-df":
         dataset = CelebDFLoader(
@@ -105,65 +118,138 @@ def get_dataloader(args):
         batch_size=args.batch_size,
         shuffle=False,
         num_workers=4,
-        pin_memory=True
+        pin_memory=True,
+        persistent_workers=True,
+        prefetch_factor=4
     )
     
-def evaluate(model, dataloader, device="cuda", args=None):
-    """评估模型"""
+def compute_metrics(preds, labels):
+    """
+    计算二分类评估指标
+    
+    阈值类指标均由布尔掩码统计的混淆矩阵推导，仅AUC与AP需要连续预测值
+    
+    :param preds: 伪造类预测概率
+    :type preds: np.ndarray
+    :param labels: 真实标签，0=真实，1=伪造
+    :type labels: np.ndarray
+    :return: 返回指标字典
+    :rtype: dict
+    """
+    binary_preds = preds >= 0.5
+    fake_mask = labels.astype(bool)
+    tp = int((binary_preds & fake_mask).sum())
+    tn = int((~binary_preds & ~fake_mask).sum())
+    fp = int((binary_preds & ~fake_mask).sum())
+    fn = int((~binary_preds & fake_mask).sum())
+    conf_matrix = np.array([[tn, fp], [fn, tp]])
+    
+    return {
+        'accuracy': (tp + tn) / max(tn + fp + fn + tp, 1),
+        'auc': roc_auc_score(labels, preds),
+        'precision': tp / (tp + fp) if tp + fp > 0 else 0.0,
+        'recall': tp / (tp + fn) if tp + fn > 0 else 0.0,
+        'f1': 2 * tp / (2 * tp + fp + fn) if tp + fp + fn > 0 else 0.0,
+        'ap': average_precision_score(labels, preds),
+        'conf_matrix': conf_matrix
+    }
+    
+def predict(model, dataloader, device="cuda", args=None):
+    """
+    遍历数据加载器，收集逐样本的预测结果
+    
+    :return: 返回与数据集索引对齐的逐样本数组字典，包含``preds``、``labels``、``loss``与``orth_loss``，
+        未计算损失时``loss``与``orth_loss``为空数组
+    :rtype: dict
+    """
     model.eval()
-    all_preds = []
-    all_labels = []
-    test_loss = 0.0
-    test_orth_loss = []
-    criterion = BCEWithLogitsLoss()
     
     print("Evaluating model on the test set...")
     
     ablation_mode = args.ablation if hasattr(args, 'ablation') else 'dynamic'
     print(f"Using ablation mode: {ablation_mode}")
     
-    with torch.no_grad():
-        for frames, labels in tqdm(dataloader, desc="Testing"):
-            frames = frames.to(device)
-            labels = labels.to(device)
+    # AUC/F1等指标只需logits，损失仅在需要时计算（可视化需要正交约束）
+    compute_loss = getattr(args, 'compute_loss', False) or getattr(args, 'visualize', False)
+    compute_orth = compute_loss and ablation_mode == 'dynamic'
+    
+    # 预分配设备端缓冲区，遍历结束后一次性拷回主机，避免逐批次同步
+    num_samples = len(dataloader.dataset)
+    preds_buf = torch.empty(num_samples, device=device, dtype=torch.float32)
+    labels_buf = torch.empty(num_samples, device=device, dtype=torch.uint8)
+    losses_buf = torch.empty(num_samples if compute_loss else 0, device=device, dtype=torch.float32)
+    orth_losses_buf = torch.empty(num_samples if compute_orth else 0, device=device, dtype=torch.float32)
+    cursor = 0
+    
+    precision = getattr(args, 'precision', 'fp32')
+    autocast_dtype = PRECISION_DTYPES[precision]
+    
+    with torch.inference_mode(), torch.autocast(device_type=torch.device(device).type,
+                                                dtype=autocast_dtype,
+                                                enabled=autocast_dtype is not None):
+        prefetcher = CUDAPrefetcher(dataloader, device)
+        pbar = tqdm(total=len(prefetcher), desc="Testing")
+        while (batch := prefetcher.next()) is not None:
+            frames, labels = batch
+            frames = normalize_frames(frames)
             
             outputs = model(frames, batch_size=args.batch_size, ablation=ablation_mode)
+            logits = outputs['logits'].float().view(-1)
             
-            if ablation_mode == 'dynamic':
-                loss, losses = combined_loss(outputs, labels, criterion, epoch=1, max_epochs=1)
-                test_orth_loss.append(losses['orth_loss'])
-            else:
-                # 对于其他模式，使用简单的BCEWithLogitsLoss
-                loss = criterion(outputs['logits'].squeeze(), labels.float())
-            test_loss += loss.item() * frames.size(0)
+            bs = labels.size(0)
             
-            # 收集预测结果
-            probs = torch.sigmoid(outputs['logits']).detach().cpu().numpy()
-            all_preds.extend(probs)
-            all_labels.extend(labels.cpu().numpy())
-            if ablation_mode == 'dynamic':
-                test_orth_loss.append(losses['orth_loss'])
+            if compute_loss:
+                # 逐样本分类损失，便于按样本子集统计
+                loss = F.binary_cross_entropy_with_logits(logits, labels.float(), reduction='none')
+                if compute_orth:
+                    # 与combined_loss(epoch=1, max_epochs=1)一致，正交约束权重为1，按批次计入每个样本
+                    orth_loss = orthogonal_loss(outputs['space'].float(), outputs['freq'].float())
+                    loss = loss + orth_loss
+                    orth_losses_buf[cursor:cursor+bs] = orth_loss
+                losses_buf[cursor:cursor+bs] = loss
             
+            # 收集预测结果
+            preds_buf[cursor:cursor+bs] = torch.sigmoid(logits)
+            labels_buf[cursor:cursor+bs] = labels
+            cursor += bs
+            pbar.update(1)
+        pbar.close()
     
-    test_loss /= len(dataloader.dataset)
+    return {
+        'preds': preds_buf.cpu().numpy(),
+        'labels': labels_buf.cpu().numpy(),
+        'loss': losses_buf.cpu().numpy(),
+        'orth_loss': orth_losses_buf.cpu().numpy()
+    }
+
+def summarize_predictions(results, mask=None):
+    """
+    根据逐样本预测结果统计评估指标
     
-    binary_preds = [1 if p >= 0.5 else 0 for p in all_preds]
+    :param results: ``predict``返回的逐样本结果
+    :type results: dict
+    :param mask: 样本子集掩码，为None时统计全部样本
+    :type mask: np.ndarray
+    :return: 返回指标字典
+    :rtype: dict
+    """
+    preds, labels, losses, orth_losses = results['preds'], results['labels'], results['loss'], results['orth_loss']
+    if mask is not None:
+        preds, labels = preds[mask], labels[mask]
+        losses = losses[mask] if len(losses) > 0 else losses
+        orth_losses = orth_losses[mask] if len(orth_losses) > 0 else orth_losses
     
-    metrics = {
-        'loss': test_loss,
-        'orth_loss': test_orth_loss,
-        'accuracy': accuracy_score(all_labels, binary_preds),
-        'auc': roc_auc_score(all_labels, all_preds),
-        'precision': precision_score(all_labels, binary_preds),
-        'recall': recall_score(all_labels, binary_preds),
-        'f1': f1_score(all_labels, binary_preds),
-        'ap': average_precision_score(all_labels, all_preds),
-        'conf_matrix': confusion_matrix(all_labels, binary_preds),
-        'labels': all_labels,
-        'preds': all_preds
+    return {
+        'loss': float(losses.mean()) if len(losses) > 0 else float('nan'),
+        'orth_loss': orth_losses,
+        **compute_metrics(preds, labels),
+        'labels': labels,
+        'preds': preds
     }
-    
-    return metrics, np.array(all_preds), np.array(all_labels)
+
+def evaluate(model, dataloader, device="cuda", args=None):
+    """评估模型，预测结果与标签见返回指标中的``preds``与``labels``"""
+    return summarize_predictions(predict(model, dataloader, device=device, args=args))
 
 def main():
     args = parse_args()
@@ -173,68 +259,54 @@ def main():
     torch.manual_seed(args.seed)
     torch.cuda.manual_seed_all(args.seed)
     
+    configure_backends()
+    
     os.makedirs(args.output, exist_ok=True)
     
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     print(f"Using device: {device}")
     print("="*50)
     
-    model = load_model(args.model_path, dim=args.dim, device=device)
+    model = load_model(args.model_path, dim=args.dim, device=device, compile_model=args.compile)
     
     # 按方法评估
     if args.dataset == "ff++":
         methods = ['Deepfakes', 'Face2Face', 'FaceSwap', 'NeuralTextures', 'FaceShifter']
         all_results = {}
         
-        # 先添加一个整体评估
+        # 一次遍历包含所有方法的测试集，再按样本掩码分别统计整体与各方法的指标
         print("\n" + "="*50)
-        print("Evaluating on all methods combined")
+        print("Evaluating on all methods")
+        args.all_methods = True
         dataloader = get_dataloader(args)
+        sample_methods, balanced = dataloader.dataset.get_sample_methods()
+        is_real = sample_methods == 'Original'
+        
         start_time = time.time()
-        metrics, preds, labels = evaluate(model, dataloader, device=device, args=args)
+        results = predict(model, dataloader, device=device, args=args)
         eval_time = time.time() - start_time
         print(f"Evaluation on all methods complete in {eval_time:.2f}s")
-        all_results['All'] = metrics
         
-        # 输出整体评估结果
-        print("Results:")
-        print(f"Test Loss:      {metrics['loss']:.4f}")
-        print(f"Accuracy:       {metrics['accuracy']:.4f}")
-        print(f"AUC:            {metrics['auc']:.4f}")
-        print(f"Precision:      {metrics['precision']:.4f}")
-        print(f"Recall:         {metrics['recall']:.4f}")
-        print(f"F1 Score:       {metrics['f1']:.4f}")
-        print(f"Average Precision: {metrics['ap']:.4f}")
-        print(f"Confusion Matrix:")
-        print(metrics['conf_matrix'])
-        
-        # 按照每种方法单独评估
+        subsets = {'All': balanced}
         for method in methods:
-            print("\n" + "="*50)
-            print(f"Evaluating on {method}")
-            
-            # 为特定方法创建数据加载器
-            args.single_method = method  # 添加这个属性
-            method_dataloader = get_dataloader(args)
-            
-            # 评估特定方法
-            start_time = time.time()
-            method_metrics, method_preds, method_labels = evaluate(model, method_dataloader, device=device, args=args)
-            eval_time = time.time() - start_time
-            print(f"Evaluation on {method} complete in {eval_time:.2f}s")
-            all_results[method] = method_metrics
+            subsets[method] = is_real | (sample_methods == method)
+        
+        for subset_name, mask in subsets.items():
+            metrics = summarize_predictions(results, mask)
+            all_results[subset_name] = metrics
             
-            # 输出特定方法的评估结果
-            print("Results:")
-            print(f"Test Loss:      {method_metrics['loss']:.4f}")
-            print(f"Accuracy:       {method_metrics['accuracy']:.4f}")
-            print(f"AUC:            {method_metrics['auc']:.4f}")
-            print(f"Precision:      {method_metrics['precision']:.4f}")
-            print(f"Recall:         {method_metrics['recall']:.4f}")
-            print(f"F1 Score:       {method_metrics['f1']:.4f}")
-            print(f"Average Precision: {method_metrics['ap']:.4f}")
+            # 输出评估结果
+            print("\n" + "="*50)
+            print(f"Results on {'all methods combined' if subset_name == 'All' else subset_name}:")
+            print(f"Test Loss:      {metrics['loss']:.4f}")
+            print(f"Accuracy:       {metrics['accuracy']:.4f}")
+            print(f"AUC:            {metrics['auc']:.4f}")
+            print(f"Precision:      {metrics['precision']:.4f}")
+            print(f"Recall:         {metrics['recall']:.4f}")
+            print(f"F1 Score:       {metrics['f1']:.4f}")
+            print(f"Average Precision: {metrics['ap']:.4f}")
             print(f"Confusion Matrix:")
-            print(method_metrics['conf_matrix'])
+            print(metrics['conf_matrix'])
             print("="*50)
         
         # 将结果保存为CSV文件
@@ -281,7 +353,8 @@ def main():
             all_viz_dir = os.path.join(args.output, "visualizations", "all_methods") 
             os.makedirs(all_viz_dir, exist_ok=True)
             all_viz = EvalVisualization(all_viz_dir)
-            all_viz.plot_metrics(all_results['All'], labels, preds, metrics['orth_loss'])
+            all_metrics = all_results['All']
+            all_viz.plot_metrics(all_metrics, all_metrics['labels'], all_metrics['preds'], all_metrics['orth_loss'])
             
             # 为每种方法创建单独的可视化
             for method in methods:
@@ -291,9 +364,7 @@ def main():
                 
                 # 获取该方法的结果
                 method_metrics = all_results[method]
-                method_labels = np.array(method_metrics.get('labels', []))
-                method_preds = np.array(method_metrics.get('preds', []))
-                method_viz.plot_metrics(method_metrics, method_labels, method_preds, method_metrics['orth_loss'])
+                method_viz.plot_metrics(method_metrics, method_metrics['labels'], method_metrics['preds'], method_metrics['orth_loss'])
                 
             print(f"Saved visualizations to {os.path.join(args.output, 'visualizations')}")
     
@@ -303,7 +374,7 @@ def main():
     
         # 评估模型
         start_time = time.time()
-        metrics, preds, labels = evaluate(model, dataloader, device=device, args=args)
+        metrics = evaluate(model, dataloader, device=device, args=args)
         eval_time = time.time() - start_time
         
         # 输出评估结果
@@ -347,7 +418,7 @@ def main():
             print("Generating evaluation visualizations...")
             viz = EvalVisualization(args.output)
             orth_loss = metrics['orth_loss']
-            viz.plot_metrics(metrics, labels, preds, orth_loss)
+            viz.plot_metrics(metrics, metrics['labels'], metrics['preds'], orth_loss)
             print(f"Saved visualizations to {args.output}")
 
 if __name__ == "__main__":
@@ -177,13 +177,12 @@ class DAMA(nn.Module):
         
         # 分批处理视频帧
         for start_idx in range(0, K, batch_size):
-            # torch.cuda.empty_cache()
-            
             end_idx = min(start_idx + batch_size, K)
             batch_frames = x[:, start_idx:end_idx] # [B, batch_size, C, H, W]
 
-            # 批处理帧
-            features = self._process_frame(batch_frames.flatten(0,1))
+            # 批处理帧，转换为channels_last布局避免cuDNN逐层重排
+            batch_frames = batch_frames.flatten(0,1).contiguous(memory_format=torch.channels_last)
+            features = self._process_frame(batch_frames)
 
             features_fused = features['fused'].view(B, -1, self.dim)
             mean_fused += features_fused.sum(dim=1)
@@ -15,6 +15,8 @@ class DeepfakeDetector(nn.Module):
         :type in_channels: int
         :param dama_dim: DAMA的输入特征维度
         :type dama_dim: int
+        :param batch_size: 沿帧维度分块处理的帧数
+        :type batch_size: int
         :param ablation: 实验割除项，用于消融实验
         :type ablation: str
         """
@@ -26,13 +28,15 @@ class DeepfakeDetector(nn.Module):
         
         # 消融配置
         self.ablation_config = ['dynamic', 'sfe_only', 'sfe_mwt']
+        self.configure_ablation(ablation)
         
         # 加载配置
         with open('config/architecture.yaml', 'r') as f:
             self.config = yaml.safe_load(f)
         
-        # DAMA模块
+        # DAMA模块，卷积权重使用channels_last布局以匹配Tensor Core卷积核
         self.dama = DAMA(in_channels=in_channels, dim=dama_dim, num_heads=4, levels=3, batch_size=batch_size)
+        self.dama = self.dama.to(memory_format=torch.channels_last)
         
         self.mwt = MWT(in_channels=in_channels, dama_dim=dama_dim)
         self.sfe = EfficientViT(
@@ -50,6 +54,11 @@ class DeepfakeDetector(nn.Module):
             output_mode='cls'
         )
         
+        # EfficientNet骨干与MWT同样使用channels_last布局，与sfe_mwt分支的输入布局一致
+        self.mwt = self.mwt.to(memory_format=torch.channels_last)
+        self.sfe = self.sfe.to(memory_format=torch.channels_last)
+        self.sfe_cls = self.sfe_cls.to(memory_format=torch.channels_last)
+        
         # 特征融合层
         self.fusion_gate = nn.Sequential(
             nn.Linear(dama_dim*2, 2),
@@ -67,9 +76,19 @@ class DeepfakeDetector(nn.Module):
             nn.Linear(64, 1)
         )
         
-    def forward(self, x, batch_size, ablation):
+    def forward(self, x, batch_size=None, ablation=None):
         """
         前向传播
+        
+        批次大小由输入张量推断；``batch_size``与``ablation``缺省时沿用初始化配置，
+        保持参数不变可避免torch.compile因Python参数变化而重新编译
+        
+        :param x: 输入视频帧 (B x K x C x H x W)
+        :type x: torch.Tensor
+        :param batch_size: 沿帧维度分块处理的帧数，None表示沿用当前配置
+        :type batch_size: int, optional
+        :param ablation: 消融配置，None表示沿用当前配置
+        :type ablation: str, optional
         """
         if batch_size is not None:
             self.batch_size = batch_size
@@ -98,19 +117,18 @@ class DeepfakeDetector(nn.Module):
                 'freq': freq_feats
             }
         elif self.ablation == 'sfe_only':
-            all_logits = []
+            sum_logits = torch.zeros(B, 1, device=x.device)
             
             for start_idx in range(0, K, self.batch_size):
                 end_idx = min(start_idx + self.batch_size, K)
-                batch_frames = x[:, start_idx:end_idx].flatten(0, 1)
+                batch_frames = x[:, start_idx:end_idx].flatten(0, 1).contiguous(memory_format=torch.channels_last)
                 
                 logits = self.sfe_cls(batch_frames)
                 logits = logits.view(B, -1, 1)
-                all_logits.append(logits)
+                sum_logits += logits.sum(dim=1)
                 
-            # 拼接所有帧的logits
-            all_logits = torch.cat(all_logits, dim=1)
-            final_logits = all_logits.mean(dim=1)
+            # 对所有帧的logits取平均
+            final_logits = sum_logits / K
             
             return {
                 'logits': final_logits,
@@ -118,28 +136,28 @@ class DeepfakeDetector(nn.Module):
             }
         elif self.ablation == 'sfe_mwt':
             # 简单拼接融合
-            sfe_features = []
-            mwt_features = []
+            sfe_features = torch.zeros(B, self.dama_dim, device=x.device)
+            mwt_features = torch.zeros(B, self.dama_dim, device=x.device)
             
             for start_idx in range(0, K, self.batch_size):
                 end_idx = min(start_idx + self.batch_size, K)
-                batch_frames = x[:, start_idx:end_idx].flatten(0, 1)
+                batch_frames = x[:, start_idx:end_idx].flatten(0, 1).contiguous(memory_format=torch.channels_last)
                 
                 # SFE特征
                 sfe_feats = self.sfe(batch_frames)
                 sfe_feats = self.feat_pooler(sfe_feats).squeeze(-1).squeeze(-1)
                 sfe_feats = sfe_feats.view(B, -1, self.dama_dim)
-                sfe_features.append(sfe_feats)
+                sfe_features += sfe_feats.sum(dim=1)
                 
                 # MWT特征
                 mwt_feats = self.mwt(batch_frames)
                 mwt_feats = mwt_feats.squeeze(-1).squeeze(-1)
                 mwt_feats = mwt_feats.view(B, -1, self.dama_dim)
-                mwt_features.append(mwt_feats)
+                mwt_features += mwt_feats.sum(dim=1)
             
-            # 拼接所有帧的特征
-            sfe_features = torch.cat(sfe_features, dim=1).mean(dim=1)
-            mwt_features = torch.cat(mwt_features, dim=1).mean(dim=1)
+            # 对所有帧的特征取平均
+            sfe_features /= K
+            mwt_features /= K
             
             # 特征融合
             combined = torch.cat([sfe_features, mwt_features], dim=1)
@@ -8,7 +8,7 @@ import numpy as np
 from torch.utils.data import DataLoader
 from torch.nn.functional import softmax
 
-from train import combined_loss
+from train import combined_loss, configure_backends, PRECISION_DTYPES
 from network.model import DeepfakeDetector
 from config.focal_loss import BinaryFocalLoss
 from config.transforms import get_transforms
@@ -37,6 +37,9 @@ def parse_args():
                         help="Specific sample index to test (optional)")
     parser.add_argument("--max-epoch", "--mep", type=int, default=10, 
                         help="Maximum number of epochs, the number is set to calculate different steps of loss")
+    parser.add_argument("--precision", "--p", type=str, default="fp32",
+                        choices=list(PRECISION_DTYPES.keys()),
+                        help="Autocast precision for the forward passes")
     return parser.parse_args()
 
 def test_model(args):
@@ -48,6 +51,8 @@ def test_model(args):
     print(f"Device: {device}")
     print("="*50)
     
+    configure_backends()
+    
     # 参数设置
     batch_size = 8
     frame_count = 24
@@ -117,7 +122,10 @@ def test_model(args):
         B, K, C, H, W = frames.shape
         
         # 分步训练测试
-        with torch.no_grad():
+        autocast_dtype = PRECISION_DTYPES[args.precision]
+        with torch.inference_mode(), torch.autocast(device_type=device.type,
+                                                    dtype=autocast_dtype,
+                                                    enabled=autocast_dtype is not None):
             # DAMA模块
             print("3. Testing DAMA module...")
             dama_feats = model.dama(frames, batch_size=batch_size)
@@ -128,23 +136,17 @@ def test_model(args):
             
             # MWT模块
             print("4. Testing MWT module...")
-            mwt_outputs = []
-            for k in range(K):
-                frame_k = frames[:, k]
-                mwt_output = model.mwt(frame_k)
-                mwt_outputs.append(mwt_output)
-            mwt_outputs = torch.stack(mwt_outputs)
+            # 将时间维并入批次维，一次前向处理所有帧，输出保持[K, B, ...]排列
+            flat_frames = frames.transpose(0, 1).reshape(K * B, C, H, W)
+            mwt_flat = model.mwt(flat_frames)
+            mwt_outputs = mwt_flat.view(K, B, *mwt_flat.shape[1:])
             print(f"MWT output shape: {mwt_outputs.shape}")
             print("="*50)
             
             # SFE模块
             # print("5. Testing SFE module...")
-            # sfe_outputs = []
-            # for k in range(K):
-            #     frame_k = frames[:, k]
-            #     sfe_output = model.sfe(frame_k)
-            #     sfe_outputs.append(sfe_output)
-            # sfe_outputs = torch.stack(sfe_outputs)
+            # sfe_flat = model.sfe(flat_frames)
+            # sfe_outputs = sfe_flat.view(K, B, *sfe_flat.shape[1:])
             # print("SFE output keys: ")
             # print(f"MWT output shape: {sfe_outputs.shape}")
             # print("="*50)
@@ -171,11 +173,11 @@ def test_model(args):
             criterion = torch.nn.BCEWithLogitsLoss()
             loss, losses = combined_loss(outputs, labels, criterion, epoch=5, max_epochs=args.max_epoch)
             print(f"Loss: {loss.item()}")
-            print(f"Losses: {losses}")
+            print(f"Losses: {({name: value.item() for name, value in losses.items()})}")
             print("="*50)
             
             # 打印结果
-            fake_probs = torch.sigmoid(outputs['logits'].squeeze())
+            fake_probs = torch.sigmoid(outputs['logits'].float().squeeze())
             print(f"Predicted probabilities: ")
             for i in range(len(labels)):
                 fake_prob = fake_probs[i].item()
@@ -2,6 +2,8 @@ import torch.multiprocessing as mp
 mp.set_start_method('spawn', force=True)
 
 import argparse
+import builtins
+import contextlib
 import os
 import time
 import copy
@@ -10,16 +12,18 @@ import random
 import numpy as np
 import torch.nn as nn
 import torch.optim as optim
+import torch.distributed as dist
 from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor
 from torch.nn import BCEWithLogitsLoss
 from torch.nn import functional as F
-# from torch.cuda.amp import autocast, GradScaler
 from torch.utils.data import DataLoader
-from sklearn.metrics import roc_auc_score, accuracy_score # type: ignore
+from torch.utils.data.distributed import DistributedSampler
+from torch.nn.parallel import DistributedDataParallel
 
 from network.model import DeepfakeDetector
-from config.data_loader import FaceForensicsLoader
-from config.transforms import get_transforms
+from config.data_loader import FaceForensicsLoader, CUDAPrefetcher, DistributedEvalSampler
+from config.transforms import get_transforms, normalize_frames
 from config.focal_loss import BinaryFocalLoss
 from utils.visualization import TrainVisualization
 
@@ -45,13 +49,178 @@ def parse_args():
     parser.add_argument("--accum-steps", "--as", type=int, default=2,
                         help="Gradient accumulation steps")
     parser.add_argument("--multi-gpu", "--mg", action="store_true",
-                        help="Use multiple GPUs for training")
+                        help="Use DistributedDataParallel, launch with torchrun --nproc_per_node=N train.py")
     parser.add_argument("--resume", type=str, default=None,
                         help="Path to checkpoint to resume from")
     parser.add_argument("--seed", type=int, default=42,
                         help="Random seed")
+    parser.add_argument("--precision", "--p", type=str, default="fp32",
+                        choices=list(PRECISION_DTYPES.keys()),
+                        help="Autocast precision for training, fp16 enables loss scaling")
+    parser.add_argument("--compile", action="store_true",
+                        help="Compile the model forward with torch.compile")
+    parser.add_argument("--num-workers", "--nw", type=int, default=4,
+                        help="Number of DataLoader worker processes per GPU")
+    parser.add_argument("--save-every", "--se", type=int, default=5,
+                        help="Save a resumable checkpoint every N epochs")
+    parser.add_argument("--keep-checkpoints", "--kc", type=int, default=3,
+                        help="Number of most recent checkpoints to keep, 0 keeps all")
     return parser.parse_args()
 
+# 混合精度配置，fp32表示不启用autocast
+PRECISION_DTYPES = {
+    'fp32': None,
+    'bf16': torch.bfloat16,
+    'fp16': torch.float16
+}
+
+def configure_backends():
+    """输入形状固定（训练时由drop_last保证），启用cuDNN卷积算法自动调优，矩阵乘法与卷积使用TF32"""
+    torch.backends.cudnn.benchmark = True
+    torch.set_float32_matmul_precision('high')
+    torch.backends.cudnn.allow_tf32 = True
+
+def is_main_process():
+    """是否为主进程（非分布式训练时恒为True）"""
+    return not dist.is_initialized() or dist.get_rank() == 0
+
+def reduce_sum(value):
+    """
+    分布式训练时对各进程的标量求和
+    
+    :param value: 当前进程的标量
+    :type value: float
+    :return: 返回所有进程的总和
+    :rtype: float
+    """
+    if not dist.is_initialized():
+        return value
+    tensor = torch.tensor(value, dtype=torch.float64, device=torch.cuda.current_device())
+    dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tensor.item()
+
+def to_cpu(obj):
+    """
+    递归地将状态字典中的张量拷贝到CPU，供后台线程序列化
+    
+    :param obj: 状态字典或其中的值
+    :type obj: dict or list or tuple or torch.Tensor
+    :return: 返回张量均已拷贝到CPU的副本
+    """
+    if isinstance(obj, torch.Tensor):
+        # 始终拷贝，避免后续训练原地修改正在保存的张量
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return {k: to_cpu(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(to_cpu(v) for v in obj)
+    return obj
+
+def is_compiled(model):
+    """模型是否经过torch.compile编译（分布式训练时编译的是DDP包装后的模型）"""
+    return hasattr(model, '_orig_mod')
+
+def seed_worker(worker_id):
+    """DataLoader子进程以spawn方式启动，需按torch分配的种子重新设置numpy与random"""
+    worker_seed = torch.initial_seed() % 2**32
+    np.random.seed(worker_seed)
+    random.seed(worker_seed)
+
+def build_train_loader(dataset, batch_size, distributed, seed, loader_kwargs):
+    """
+    构建训练数据加载器
+    
+    DistributedSampler在构造时固定每个进程的样本数，而update_sampling_strategy会改变数据集长度，
+    因此每轮刷新样本集后需重新构建采样器与加载器，否则采样器会以重复索引填充到旧长度
+    
+    :param dataset: 训练数据集
+    :type dataset: FaceForensicsLoader
+    :param batch_size: 批次大小
+    :type batch_size: int
+    :param distributed: 是否为分布式训练
+    :type distributed: bool
+    :param seed: 分布式采样器的随机种子
+    :type seed: int
+    :param loader_kwargs: 传给DataLoader的其余参数
+    :type loader_kwargs: dict
+    :return: 返回``(loader, sampler)``，非分布式训练时sampler为None
+    :rtype: tuple
+    """
+    sampler = DistributedSampler(dataset, shuffle=True, seed=seed) if distributed else None
+    loader = DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=sampler is None,
+        sampler=sampler,
+        drop_last=True,
+        **loader_kwargs
+    )
+    return loader, sampler
+
+def setup_for_distributed(is_main):
+    """非主进程屏蔽print输出，避免多进程重复打印"""
+    builtin_print = builtins.print
+    
+    def print(*args, **kwargs):
+        if is_main or kwargs.pop('force', False):
+            builtin_print(*args, **kwargs)
+    
+    builtins.print = print
+
+def gather_predictions(preds, labels):
+    """
+    分布式训练时汇总各进程的预测结果与标签
+    
+    :param preds: 当前进程的预测概率
+    :type preds: torch.Tensor
+    :param labels: 当前进程的标签
+    :type labels: torch.Tensor
+    :return: 返回所有进程拼接后的``(preds, labels)``
+    :rtype: tuple
+    """
+    if not dist.is_initialized():
+        return preds, labels
+    world_size = dist.get_world_size()
+    local = torch.stack([preds.float(), labels.float()])  # [2, N]
+    
+    # 各进程样本数可能不同，先同步长度再按最大长度填充后收集
+    size = torch.tensor([local.size(1)], device=local.device)
+    sizes = [torch.zeros_like(size) for _ in range(world_size)]
+    dist.all_gather(sizes, size)
+    sizes = [int(s.item()) for s in sizes]
+    
+    padded = local.new_zeros((2, max(sizes)))
+    padded[:, :local.size(1)] = local
+    gathered = [torch.empty_like(padded) for _ in range(world_size)]
+    dist.all_gather(gathered, padded)
+    merged = torch.cat([g[:, :n] for g, n in zip(gathered, sizes)], dim=1)
+    return merged[0], merged[1]
+
+def binary_auroc(preds, labels):
+    """
+    在GPU上计算二分类AUC（Mann-Whitney U统计量，并列分数取平均秩，与sklearn结果一致）
+    
+    :param preds: 预测概率 (N,)
+    :type preds: torch.Tensor
+    :param labels: 标签，0=真实，1=伪造 (N,)
+    :type labels: torch.Tensor
+    :return: 返回AUC，只有单一类别时返回nan
+    :rtype: float
+    """
+    labels = labels.bool()
+    n_pos = labels.sum().double()
+    n_neg = labels.numel() - n_pos
+    
+    sorted_preds, order = torch.sort(preds.double())
+    _, inverse, counts = torch.unique_consecutive(sorted_preds, return_inverse=True, return_counts=True)
+    # 每组并列分数占据秩[end-count+1, end]，取平均秩
+    ends = torch.cumsum(counts, dim=0).double()
+    ranks = (ends - (counts.double() - 1) / 2)[inverse]
+    
+    pos_rank_sum = ranks[labels[order]].sum()
+    auc = (pos_rank_sum - n_pos * (n_pos + 1) / 2) / (n_pos * n_neg)
+    return auc.item() if n_pos > 0 and n_neg > 0 else float('nan')
+
 def orthogonal_loss(space_feats, freq_feats):
     """
     正交约束损失
@@ -62,13 +231,16 @@ def orthogonal_loss(space_feats, freq_feats):
     
     # 计算协方差矩阵并惩罚非对角线元素
     cov = torch.mm(space_feats.T, freq_feats)  # [feat_dim, feat_dim]
-    diag_mask = torch.eye(feat_dim).to(cov.device)
-    off_diag = cov * (1 - diag_mask)
-    return torch.norm(off_diag, p='fro')**2 / (feat_dim*(feat_dim-1))
+    # 直接减去对角线，避免每步在主机上构造单位矩阵掩码再拷贝到GPU
+    off_diag = cov - torch.diag_embed(torch.diagonal(cov))
+    # Frobenius范数的平方即元素平方和，省去先开方再平方
+    return off_diag.pow(2).sum() / (feat_dim*(feat_dim-1))
     
 def combined_loss(outputs, labels, criterion, epoch, max_epochs):
     """
     组合损失函数，由Focal Loss和正交约束组成
+    
+    各分项以GPU标量张量返回，由调用方决定何时同步到主机
     """
     logits = outputs['logits']
     labels = labels.view(-1, 1).float()
@@ -76,8 +248,8 @@ def combined_loss(outputs, labels, criterion, epoch, max_epochs):
     if epoch < 0.2 * max_epochs:
         cls_loss = criterion(logits, labels)
         return cls_loss, {
-            'cls_loss': cls_loss.item(),
-            'orth_loss': 0.0
+            'cls_loss': cls_loss.detach(),
+            'orth_loss': cls_loss.new_zeros(())
         }
     else:
         cls_loss = criterion(logits, labels)
@@ -86,51 +258,88 @@ def combined_loss(outputs, labels, criterion, epoch, max_epochs):
         lambda_orth  = min(1.0, (epoch - 0.2 * max_epochs) / (0.5 * max_epochs))
     
     return cls_loss + lambda_orth * loss_orth, {
-        'cls_loss': cls_loss.item(),
-        'orth_loss': loss_orth.item()
+        'cls_loss': cls_loss.detach(),
+        'orth_loss': loss_orth.detach()
     }
 
-def train_epoch(model, dataloader, criterion, optimizer, device, batch_size, accum_steps=2, epoch=None, max_epochs=None):
+def train_epoch(model, dataloader, criterion, optimizer, device, accum_steps=2, epoch=None, max_epochs=None,
+                scaler=None, autocast_dtype=None):
     model.train()
-    running_loss = 0.0
-    running_cls_loss = 0.0
-    preds_all, labels_all = [], []
-    
-    optimizer.zero_grad()
-    
-    for i, (frames, labels) in enumerate(tqdm(dataloader, desc="Training iteration")):
-        frames, labels = frames.to(device), labels.to(device)
-        
-        outputs = model(frames, batch_size=batch_size, ablation='dynamic')
+    # 损失与预测在GPU上累积，轮次结束时一次性拷回主机，避免每个批次同步
+    running_loss = torch.zeros((), device=device)
+    running_cls_loss = torch.zeros((), device=device)
+    num_samples = 0
+    preds_gpu, labels_gpu = [], []
+    
+    num_batches = len(dataloader)
+    is_ddp = isinstance(getattr(model, '_orig_mod', model), DistributedDataParallel)
+    if scaler is None:
+        scaler = torch.amp.GradScaler('cuda', enabled=False)
+    
+    optimizer.zero_grad(set_to_none=True)
+    
+    # 下一批次的H2D拷贝在副流上以non_blocking方式进行，与当前批次的计算重叠
+    prefetcher = CUDAPrefetcher(dataloader, device)
+    pbar = tqdm(prefetcher, desc="Training iteration", disable=not is_main_process(), mininterval=1.0)
+    # reduce-overhead模式以CUDA Graphs重放前向与反向，每次迭代开始时标记新步骤，
+    # 使CUDA Graphs可以复用上一迭代输出占用的静态显存
+    use_cudagraphs = is_compiled(model) and device.type == 'cuda'
+    for i, (frames, labels) in enumerate(pbar):
+        if use_cudagraphs:
+            torch.compiler.cudagraph_mark_step_begin()
+        frames = normalize_frames(frames)
         
-        loss, losses = combined_loss(outputs, labels, criterion, epoch, max_epochs)
+        # 梯度累积边界：每accum_steps步及最后一个批次更新参数
+        is_update_step = (i+1) % accum_steps == 0 or (i+1) == num_batches
         
-        # 梯度累积
-        orig_loss = loss
-        loss = loss / accum_steps
-        loss.backward()
+        # 非边界微步跳过DDP梯度同步，前向也需在no_sync内，否则仍会准备同步
+        sync_context = model.no_sync() if is_ddp and not is_update_step else contextlib.nullcontext()
+        with sync_context:
+            # 前向与损失在autocast下计算，反向传播在autocast之外
+            with torch.autocast(device_type=device.type, dtype=autocast_dtype,
+                                enabled=autocast_dtype is not None):
+                outputs = model(frames)
+                
+                loss, losses = combined_loss(outputs, labels, criterion, epoch, max_epochs)
+            
+            # 梯度累积
+            orig_loss = loss
+            loss = loss / accum_steps
+            scaler.scale(loss).backward()
         
-        if (i+1) % accum_steps == 0:
-            optimizer.step()
-            optimizer.zero_grad()
+        if is_update_step:
+            # fp16下先反缩放梯度并跳过含inf/nan的更新，其他精度时scaler不生效
+            scaler.step(optimizer)
+            scaler.update()
+            optimizer.zero_grad(set_to_none=True)
+            
+            # 每20次参数更新才同步一次损失到进度条，避免逐步.item()
+            if is_main_process() and (i+1) % (20 * accum_steps) == 0:
+                pbar.set_postfix(loss=f"{orig_loss.item():.4f}",
+                                 cls=f"{losses['cls_loss'].item():.4f}",
+                                 orth=f"{losses['orth_loss'].item():.4f}",
+                                 refresh=False)
         
-        running_loss += orig_loss.item() * frames.size(0)
+        running_loss += orig_loss.detach() * frames.size(0)
+        num_samples += frames.size(0)
         running_cls_loss += losses['cls_loss'] * frames.size(0)
         
         # 分类预测
-        preds = torch.sigmoid(outputs['logits']).squeeze(1).detach().cpu().numpy()
-        preds_all.extend(preds)
-        labels_all.extend(labels.cpu().numpy())
-        
-    if len(dataloader) % accum_steps != 0:
-        optimizer.step()
-        optimizer.zero_grad()
+        preds_gpu.append(torch.sigmoid(outputs['logits'].detach().float()).squeeze(1))
+        labels_gpu.append(labels.detach())
         
-    # 计算指标
-    epoch_loss = running_loss / len(dataloader.dataset)
-    epoch_cls_loss = running_cls_loss / len(dataloader.dataset)
-    epoch_auc = roc_auc_score(labels_all, preds_all)
-    epoch_acc = accuracy_score(labels_all, [1 if p >= 0.5 else 0 for p in preds_all])
+    # 计算指标（分布式训练时汇总所有进程）
+    running_loss = reduce_sum(running_loss.item())
+    running_cls_loss = reduce_sum(running_cls_loss.item())
+    num_samples = reduce_sum(num_samples)
+    preds_all, labels_all = gather_predictions(torch.cat(preds_gpu), torch.cat(labels_gpu))
+    
+    # drop_last丢弃了不足一个批次的样本，按实际参与训练的样本数求平均
+    epoch_loss = running_loss / num_samples
+    epoch_cls_loss = running_cls_loss / num_samples
+    # AUC与准确率直接在GPU上计算，不再拷回主机
+    epoch_auc = binary_auroc(preds_all, labels_all)
+    epoch_acc = ((preds_all >= 0.5) == labels_all.bool()).float().mean().item()
     
     return {
         'loss': epoch_loss,
@@ -139,32 +348,41 @@ def train_epoch(model, dataloader, criterion, optimizer, device, batch_size, acc
         'acc': epoch_acc
     }
     
-def val_epoch(model, dataloader, criterion, device, batch_size, epoch=None, max_epochs=None):
+def val_epoch(model, dataloader, criterion, device, epoch=None, max_epochs=None, autocast_dtype=None):
     model.eval()
-    running_loss = 0.0
-    running_cls_loss = 0.0
-    preds_all, labels_all = [], []
+    n_samples = len(dataloader.dataset)
+    running_loss = torch.zeros((), device=device)
+    running_cls_loss = torch.zeros((), device=device)
+    preds_gpu, labels_gpu = [], []
     
+    use_cudagraphs = is_compiled(model) and device.type == 'cuda'
     with torch.no_grad():
-        for frames, labels in dataloader:
-            frames, labels = frames.to(device), labels.to(device)
+        for frames, labels in CUDAPrefetcher(dataloader, device):
+            if use_cudagraphs:
+                torch.compiler.cudagraph_mark_step_begin()
+            frames = normalize_frames(frames)
+            with torch.autocast(device_type=device.type, dtype=autocast_dtype,
+                                enabled=autocast_dtype is not None):
+                outputs = model(frames)
+                loss, losses = combined_loss(outputs, labels, criterion, epoch, max_epochs)
             
-            outputs = model(frames, batch_size=batch_size, ablation='dynamic')
-            loss, losses = combined_loss(outputs, labels, criterion, epoch, max_epochs)
-            
-            running_loss += loss.item() * frames.size(0)
+            running_loss += loss * frames.size(0)
             running_cls_loss += losses['cls_loss'] * frames.size(0)
             
             # 分类预测
-            preds = torch.sigmoid(outputs['logits']).squeeze(1).detach().cpu().numpy()
-            preds_all.extend(preds)
-            labels_all.extend(labels.cpu().numpy())
+            preds_gpu.append(torch.sigmoid(outputs['logits'].float()).squeeze(1))
+            labels_gpu.append(labels)
+    
+    # 计算指标（分布式训练时汇总所有进程）
+    running_loss = reduce_sum(running_loss.item())
+    running_cls_loss = reduce_sum(running_cls_loss.item())
+    preds_all, labels_all = gather_predictions(torch.cat(preds_gpu), torch.cat(labels_gpu))
     
-    # 计算指标
-    epoch_loss = running_loss / len(dataloader.dataset)
-    epoch_cls_loss = running_cls_loss / len(dataloader.dataset)
-    epoch_auc = roc_auc_score(labels_all, preds_all)
-    epoch_acc = accuracy_score(labels_all, [1 if p >= 0.5 else 0 for p in preds_all])
+    epoch_loss = running_loss / n_samples
+    epoch_cls_loss = running_cls_loss / n_samples
+    # AUC与准确率直接在GPU上计算，不再拷回主机
+    epoch_auc = binary_auroc(preds_all, labels_all)
+    epoch_acc = ((preds_all >= 0.5) == labels_all.bool()).float().mean().item()
     
     return {
         'loss': epoch_loss,
@@ -183,14 +401,29 @@ def main():
     torch.manual_seed(args.seed)
     torch.cuda.manual_seed_all(args.seed)
     
+    configure_backends()
+    
     print("Start setting...")
     
     # 检查可用GPU数量
     num_gpus = torch.cuda.device_count()
     print(f"Number of GPUs available: {num_gpus}")
     
-    # 设置设备
-    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    # 配置分布式训练，每个进程对应一块GPU（通过torchrun启动）
+    distributed = args.multi_gpu and 'LOCAL_RANK' in os.environ
+    if args.multi_gpu and not distributed:
+        print("--multi-gpu requires launching with torchrun --nproc_per_node=N train.py, falling back to a single device")
+    
+    if distributed:
+        local_rank = int(os.environ['LOCAL_RANK'])
+        torch.cuda.set_device(local_rank)
+        dist.init_process_group(backend='nccl')
+        device = torch.device('cuda', local_rank)
+        setup_for_distributed(dist.get_rank() == 0)
+        print(f"Distributed training with {dist.get_world_size()} processes")
+    else:
+        # 设置设备
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
     print(f"Device: {device}")
     
     if torch.cuda.is_available():
@@ -202,8 +435,8 @@ def main():
     
     # 数据加载器
     print("Initializing data loaders...")
-    # 获取数据转换
-    transforms = get_transforms()
+    # 获取数据转换，子进程输出uint8帧，归一化在GPU上完成以减少进程间传输量
+    transforms = get_transforms(normalize=False, device=device)
     
     train_dataset = FaceForensicsLoader(
         root=args.root,
@@ -219,20 +452,25 @@ def main():
         transform=transforms['val']
     )
     
-    train_loader = DataLoader(
-        train_dataset,
-        batch_size=args.batch_size,
-        shuffle=True,
-        num_workers=0,
-        pin_memory=True
+    # 分布式训练时各进程读取互不重叠的数据分片，训练加载器在每轮刷新样本集后构建
+    # 验证集不填充重复样本，使汇总后的指标与进程数无关
+    val_sampler = DistributedEvalSampler(val_dataset) if distributed else None
+    
+    # 每轮update_sampling_strategy都会改变伪造样本集，子进程持有数据集副本，
+    # 因此不使用persistent_workers，使每轮重新创建的子进程拿到最新的样本集
+    loader_kwargs = dict(
+        num_workers=args.num_workers,
+        pin_memory=True,
+        worker_init_fn=seed_worker,
+        prefetch_factor=4 if args.num_workers > 0 else None
     )
     
     val_loader = DataLoader(
         val_dataset,
         batch_size=args.batch_size,
         shuffle=False,
-        num_workers=0,
-        pin_memory=True
+        sampler=val_sampler,
+        **loader_kwargs
     )
    
     print(f"Train dataset length: {len(train_dataset)}")
@@ -245,10 +483,24 @@ def main():
         dama_dim=args.dim,
         batch_size=args.batch_size
     ).to(device)
+    # 保存与恢复检查点时使用未包装的模型，使权重键名与单卡一致（不含_orig_mod./module.前缀）
+    model_without_ddp = model
+    
+    if distributed:
+        # 消融分支（sfe、sfe_cls等）在dynamic模式下不参与前向，需要查找未使用参数
+        model = DistributedDataParallel(
+            model,
+            device_ids=[device.index],
+            output_device=device.index,
+            gradient_as_bucket_view=True,
+            broadcast_buffers=False,
+            find_unused_parameters=True
+        )
     
-    if args.multi_gpu and num_gpus > 1:
-        # 配置分布式训练
-        model = nn.DataParallel(model)
+    # 仅编译网络前向，损失函数中依赖epoch的分支留在Python中执行；
+    # 在DDP包装后编译，使Dynamo按梯度桶切分计算图，保留反向计算与梯度通信的重叠
+    if args.compile and device.type == 'cuda':
+        model = torch.compile(model, mode='reduce-overhead', fullgraph=False, dynamic=False)
     
     print("Hyperparameters:")
     print(f"Batch size: {args.batch_size}")
@@ -256,6 +508,8 @@ def main():
     print(f"Learning rate: {args.lr}")
     print(f"Feature dimension: {args.dim}")
     print(f"Frame count: {args.frame_count}")
+    print(f"Precision: {args.precision}")
+    print(f"Compile: {args.compile}")
     print("Input size: (224, 224)")
     print("Model initialized successfully!")
     
@@ -270,25 +524,49 @@ def main():
     alpha = torch.tensor([fake_count / (real_count + fake_count)]).to(device)
     
     criterion = BCEWithLogitsLoss(pos_weight=alpha)
-    optimizer = optim.Adam(model.parameters(), lr=args.lr, weight_decay=1e-4)
+    # EfficientNet前几层参数被冻结，只将可训练参数交给优化器
+    trainable_params = [p for p in model.parameters() if p.requires_grad]
+    optimizer = optim.Adam(trainable_params, lr=args.lr, weight_decay=1e-4)
     scheduler = optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=args.epochs, eta_min=1e-7)
     
+    # 混合精度：仅fp16需要梯度缩放，bf16动态范围与fp32一致
+    autocast_dtype = PRECISION_DTYPES[args.precision]
+    scaler = torch.amp.GradScaler('cuda', enabled=args.precision == 'fp16' and device.type == 'cuda')
+    
+    start_epoch = 0
+    best_val_auc = 0.0
     if args.resume is not None and os.path.isfile(args.resume):
         print(f"Resuming from checkpoint: {args.resume}")
         checkpoint = torch.load(args.resume, map_location=device)
-        model.load_state_dict(checkpoint['model_state_dict'])
-        optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
+        model_without_ddp.load_state_dict(checkpoint['model_state_dict'])
         scheduler.load_state_dict(checkpoint['scheduler_state_dict'])
+        try:
+            optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
+        except ValueError as e:
+            # 旧检查点的优化器包含被冻结的参数，参数组大小不一致时使用新的优化器状态
+            print(f"Warning: failed to load optimizer state ({e}), continuing with a fresh optimizer state")
+            for group, lr in zip(optimizer.param_groups, scheduler.get_last_lr()):
+                group['lr'] = lr
+        if 'scaler_state_dict' in checkpoint:
+            scaler.load_state_dict(checkpoint['scaler_state_dict'])
         start_epoch = checkpoint.get('epoch', 0) + 1
         best_val_auc = checkpoint.get('best_val_auc', 0.0)
         print(f"Resumed at epoch {start_epoch}, best_val_auc={best_val_auc}")
     
-    best_val_auc = 0.0
-    for epoch in range(args.epochs):
+    # 检查点在后台线程中写入磁盘，单线程保证保存与删除按提交顺序执行
+    saver = ThreadPoolExecutor(max_workers=1) if is_main_process() else None
+    pending_saves = []
+    saved_checkpoints = []
+    
+    for epoch in range(start_epoch, args.epochs):
         print(f"\nEpoch {epoch+1}/{args.epochs}\n{'='*50}")
         
         train_dataset.update_sampling_strategy(epoch, args.epochs)
         val_dataset.update_sampling_strategy(epoch, args.epochs)
+        train_loader, train_sampler = build_train_loader(train_dataset, args.batch_size, distributed,
+                                                         args.seed, loader_kwargs)
+        if train_sampler is not None:
+            train_sampler.set_epoch(epoch)
         
         if torch.cuda.is_available():
             torch.cuda.empty_cache()
@@ -296,27 +574,47 @@ def main():
         start_time = time.time()
         
         # 训练
-        train_metrics = train_epoch(model, train_loader, criterion, optimizer, device, args.batch_size, args.accum_steps, epoch, args.epochs)
+        train_metrics = train_epoch(model, train_loader, criterion, optimizer, device, args.accum_steps, epoch, args.epochs,
+                                    scaler, autocast_dtype)
         scheduler.step()
         
         # 验证
         with torch.no_grad():
-            val_metrics = val_epoch(model, val_loader, criterion, device, args.batch_size, epoch, args.epochs)
+            val_metrics = val_epoch(model, val_loader, criterion, device, epoch, args.epochs,
+                                    autocast_dtype)
+        
+        is_best = val_metrics['auc'] > best_val_auc
+        save_checkpoint = is_best or (epoch+1) % args.save_every == 0 or (epoch+1) == args.epochs
+        
+        if is_main_process():
+            # 等待上一轮的保存完成，并抛出其中的异常
+            for future in pending_saves:
+                future.result()
+            pending_saves.clear()
         
-        # 保存最佳模型
-        if val_metrics['auc'] > best_val_auc:
+        # 保存最佳模型（仅主进程写入）
+        if is_best:
             best_val_auc = val_metrics['auc']
-            torch.save(model.state_dict(), os.path.join(args.output, 'best_model.pth'))
+            if is_main_process():
+                pending_saves.append(saver.submit(torch.save, to_cpu(model_without_ddp.state_dict()),
+                                                  os.path.join(args.output, 'best_model.pth')))
             print(f"New best model saved with AUC: {best_val_auc}")
             
-        # 检查点
-        torch.save({
-            'epoch': epoch,
-            'model_state_dict': model.state_dict(),
-            'optimizer_state_dict': optimizer.state_dict(),
-            'scheduler_state_dict': scheduler.state_dict(),
-            'best_val_auc': best_val_auc,
-        }, os.path.join(args.output, f'checkpoint_{epoch+1}.pth'))
+        # 检查点：每save_every轮、最后一轮及出现最佳模型时保存，仅保留最近keep_checkpoints个
+        if save_checkpoint and is_main_process():
+            checkpoint_path = os.path.join(args.output, f'checkpoint_{epoch+1}.pth')
+            pending_saves.append(saver.submit(torch.save, to_cpu({
+                'epoch': epoch,
+                'model_state_dict': model_without_ddp.state_dict(),
+                'optimizer_state_dict': optimizer.state_dict(),
+                'scheduler_state_dict': scheduler.state_dict(),
+                'scaler_state_dict': scaler.state_dict(),
+                'best_val_auc': best_val_auc,
+            }), checkpoint_path))
+            saved_checkpoints.append(checkpoint_path)
+            
+            if args.keep_checkpoints > 0 and len(saved_checkpoints) > args.keep_checkpoints:
+                pending_saves.append(saver.submit(os.remove, saved_checkpoints.pop(0)))
         
         epoch_time = time.time() - start_time
         print(f"Epoch {epoch+1}/{args.epochs}")
@@ -336,13 +634,22 @@ def main():
         )
         
         # 保存训练可视化
-        train_viz.save_metrics()
+        if is_main_process():
+            train_viz.save_metrics()
         
         print("="*50)
     
     # 如果有可视化参数，则生成可视化结果
-    if args.visualize:
+    if args.visualize and is_main_process():
         train_viz.plot_all()
+    
+    if saver is not None:
+        for future in pending_saves:
+            future.result()
+        saver.shutdown(wait=True)
+    
+    if distributed:
+        dist.destroy_process_group()
         
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -9,6 +9,7 @@ import sys
 
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 
+from config.transforms import normalize_frames
 from eval import load_model as load_deepfake_model, get_dataloader as get_deepfake_dataloader, evaluate as evaluate_deepfake
 from utils.xception.eval import load_model as load_xception_model, get_dataloader as get_xception_dataloader, evaluate as evaluate_xception
 
@@ -49,7 +50,7 @@ def deepfake_per_frame_eval(model, dataloader, device, args):
                     for b in range(B):
                         label = labels[b].item()
                         for n in range(N):
-                            single_frame = frames[b, n].unsqueeze(0).unsqueeze(0).to(device)  # [1, 1, C, H, W]
+                            single_frame = normalize_frames(frames[b, n].unsqueeze(0).unsqueeze(0).to(device))  # [1, 1, C, H, W]
                             outputs = model(single_frame, batch_size=1, ablation=args.ablation)
                             prob = torch.sigmoid(outputs['logits']).cpu().numpy().flatten()[0]
                             all_preds.append(prob)
@@ -59,7 +60,7 @@ def deepfake_per_frame_eval(model, dataloader, device, args):
                 elif frames.dim() == 4:
                     B, C, H, W = frames.shape
                     for b in range(B):
-                        single_frame = frames[b].unsqueeze(0).unsqueeze(0).to(device)  # [1, 1, C, H, W]
+                        single_frame = normalize_frames(frames[b].unsqueeze(0).unsqueeze(0).to(device))  # [1, 1, C, H, W]
                         label = labels[b].item()
                         outputs = model(single_frame, batch_size=1, ablation=args.ablation)
                         prob = torch.sigmoid(outputs['logits']).cpu().numpy().flatten()[0]
@@ -148,7 +149,8 @@ def main():
                 preds, labels_arr = deepfake_per_frame_eval(model, dataloader, device, data_args)
                 print(f"[{label}] Per-frame mode: total frames={len(preds)}, total labels={len(labels_arr)}")
             else:
-                metrics, preds, labels_arr = evaluate_deepfake(model, dataloader, device=device, args=data_args)
+                metrics = evaluate_deepfake(model, dataloader, device=device, args=data_args)
+                preds, labels_arr = metrics['preds'], metrics['labels']
         elif model_type.lower() == 'xception':
             class DummyArgs:
                 pass